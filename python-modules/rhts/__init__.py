@@ -24,20 +24,45 @@ import sys, xmlrpclib
 from xmlrpclib import loads, Fault
 import socket
 import time
+import random
 import os
 import os.path
-import shutil
-import tempfile
-import base64
+import cStringIO
+import threading
+import Queue
 import traceback
+import logging
 
 try:
     from OpenSSL.SSL import Error as ssl_error
 except ImportError:
     ssl_error = socket.sslerror
 
+try:
+    from pybase64 import b64encode
+except ImportError:
+    from base64 import b64encode
+
+try:
+    import hashlib
+except ImportError:
+    # No hashlib before Python 2.5
+    import md5
+    _md5 = md5.new
+else:
+    try:
+        # FIPS-enabled interpreters refuse md5 unless told it is not being
+        # used for security; the upload digests only guard against corruption.
+        hashlib.md5(usedforsecurity=False)
+        def _md5(data):
+            return hashlib.md5(data, usedforsecurity=False)
+    except (TypeError, ValueError):
+        _md5 = hashlib.md5
+
 SCHEDULER_API = 2.2
 
+log = logging.getLogger(__name__)
+
 #Exceptions
 class GenericError(Exception):
     """Base class for custom exceptions"""
@@ -60,6 +85,10 @@ class RetryError(AuthError):
     """Raised when a request is received twice and cannot be rerun"""
     faultCode = 1009
 
+#Map of faultCode to exception class, used by convertFault
+_fault_classes = dict([(v.faultCode, v) for v in globals().values()
+                       if type(v) == type(Exception) and issubclass(v, GenericError)])
+
 def ensure_connection(session):
     """ This function ensures connection to the scheduler's xmlrpc server and
     does sanity check to ensure that server and client have the same API """
@@ -86,17 +115,12 @@ def encode_args(*args,**opts):
 #A function to get create an exception from a fault
 def convertFault(fault):
     """Convert a fault to the corresponding Exception type, if possible"""
-    code = getattr(fault,'faultCode',None)
-    if code is None:
+    cls = _fault_classes.get(getattr(fault,'faultCode',None))
+    if cls is None:
         return fault
-    for v in globals().values():
-        if type(v) == type(Exception) and issubclass(v,GenericError) and \
-                code == getattr(v,'faultCode',None):
-            ret = v(fault.faultString)
-            ret.fromFault = True
-            return ret
-    #otherwise...
-    return fault
+    ret = cls(fault.faultString)
+    ret.fromFault = True
+    return ret
 
 def callMethod(session, name, *args, **opts):
     """compatibility wrapper for _callMethod"""
@@ -105,15 +129,16 @@ def callMethod(session, name, *args, **opts):
 def _callMethod(session, name, args, kwargs):
     #pass named opts in a way the server can understand
     args = encode_args(*args,**kwargs)
+    method = getattr(session, name)
 
     tries = 0
     debug = False
     max_retries = 30
-    interval = 20
+    max_interval = 30.0
     while tries <= max_retries:
         tries += 1
         try:
-            result =  session.__getattr__(name)(*args)
+            result = method(*args)
             if result == 0:
                 return True
             else:
@@ -124,78 +149,140 @@ def _callMethod(session, name, args, kwargs):
         except (socket.error,socket.sslerror,xmlrpclib.ProtocolError,ssl_error), e:
             if debug:
                 print "Try #%d for call (%s) failed: %s" % (tries, name, e)
-        time.sleep(interval)
+        # Back off exponentially, so a short network blip costs well under
+        # a second, with jitter so that many clients do not retry in step
+        interval = min(max_interval, 0.25 * 2 ** min(tries, 8))
+        time.sleep(interval * random.uniform(0.5, 1.5))
     raise RetryError, "reached maximum number of retries, last call failed with: %s" % ''.join(traceback.format_exception_only(*sys.exc_info()[:2]))
 
-def uploadWrapper(session, localfile, recipetestid, name=None, callback=None, blocksize=262144, start=0):
-    """upload a file in chunks using the uploadFile call"""
-    # XXX - stick in a config or something
-    debug = 1
+def _send_block(session, recipetestid, name, sz, digest, offset, data, retries):
+    """upload a single block, retrying if the server refuses it"""
+    for attempt in range(retries + 1):
+        log.debug("uploadFile(%r,%r,%r,%r,%r,...)", recipetestid, name, sz, digest, offset)
+        if callMethod(session, 'results.uploadFile', recipetestid, name, sz, digest, offset, data):
+            break
+    else:
+        raise GenericError, "Error uploading file %s, offset %d" %(name, offset)
+
+def _read_blocks(fo, ofs, totalsize, blocksize, blocks, abort, compute_digest=True):
+    """read and encode the file in blocks, queueing them for upload
+
+    Every block is put on the blocks queue as (size, digest, data),
+    including the empty one at the end of the file.  The digest is the md5
+    of the block, or '' if compute_digest is false or md5 is not available.
+    If reading fails (None, None, exc_info) is queued instead, so the
+    uploading thread can re-raise the error.
+    """
+    try:
+        # The file is deliberately not mmap()ed: logs can be truncated while
+        # they are uploaded, and touching a mapped page past the new end of
+        # file raises SIGBUS.
+        while ofs <= totalsize and not abort.isSet():
+            contents = fo.read(min(blocksize, totalsize - ofs))
+            size = len(contents)
+            digest = ''
+            if compute_digest and size:
+                try:
+                    digest = _md5(contents).hexdigest()
+                except ValueError:
+                    # md5 is disabled (FIPS mode), upload without digests
+                    compute_digest = False
+            # results.uploadFile base64-decodes data itself, so it has to
+            # go over the wire as a plain string; an xmlrpclib.Binary would
+            # reach the server as an object, not as the encoded text.
+            blocks.put((size, digest, b64encode(contents)))
+            del contents
+            if size == 0:
+                break
+            ofs += size
+    except:
+        blocks.put((None, None, sys.exc_info()))
+
+def uploadWrapper(session, localfile, recipetestid, name=None, callback=None, blocksize=262144,
+                  start=0, compute_digest=True):
+    """upload a file in chunks using the uploadFile call
+
+    Unless compute_digest is false, each chunk is sent with its md5 so the
+    server can verify it.  Where md5 is disabled, as in FIPS mode, chunks
+    are sent without a digest.
+    """
+    debug = log.isEnabledFor(logging.DEBUG)
     started=time.time()
     retries=3
     if name is None:
         name = os.path.basename(localfile)
 
-    tmpfile = None
+    if localfile.startswith("/sys/") or localfile.startswith("/proc/"):
+        # The size reported for pseudo-files is meaningless, and they are
+        # small, so take a snapshot in memory and upload that.
+        src = open(localfile, 'rb')
+        try:
+            contents = src.read()
+        finally:
+            src.close()
+        fo = cStringIO.StringIO(contents)
+        totalsize = len(contents)
+        del contents
+    else:
+        # Blocks are read in large pieces, so skip stdio's buffering
+        fo = open(localfile, 'rb', 0)
+        totalsize = os.fstat(fo.fileno()).st_size
     try:
-        if localfile.startswith("/sys/") or localfile.startswith("/proc/"):
-            tmpfile = tempfile.mktemp() # No tempfile.mkstemp() in 2.2 (RHEL3)
-            shutil.copy(localfile, tmpfile)
-            localfile = tmpfile
-
-        fo = file(localfile, "r")  #specify bufsize?
-        totalsize = os.path.getsize(localfile)
         ofs = start
         if ofs != 0:
             fo.seek(ofs)
-        debug = False
         if callback:
             callback(0, totalsize, 0, 0, 0)
-        while ofs <= totalsize:
-            if (totalsize - ofs) < blocksize:
-                blocksize = totalsize - ofs
+        # Blocks are read and encoded in a separate thread, so the next few
+        # are ready while the current one is on the wire.  The session is
+        # not safe to share between threads, so uploads stay in this one.
+        blocks = Queue.Queue(4)
+        abort = threading.Event()
+        reader = threading.Thread(target=_read_blocks,
+                args=(fo, ofs, totalsize, blocksize, blocks, abort, compute_digest))
+        reader.setDaemon(True)
+        reader.start()
+        try:
             lap = time.time()
-            contents = fo.read(blocksize)
-            size = len(contents)
-            data = base64.encodestring(contents)
-            digest = ''
-            if size == 0:
-                # end of file, use offset = -1 to finalize upload
-                offset = -1
-                sz = ofs
-            else:
-                offset = ofs
-                sz = size
-            del contents
-            tries = 0
-            while True:
-                if debug:
-                    print "uploadFile(%r,%r,%r,%r,%r,...)" %(recipetestid,name,sz,digest,offset)
-                if callMethod(session, 'results.uploadFile', recipetestid, name, sz, digest, offset, data):
-                    break
-                if tries <= retries:
-                    tries += 1
-                    continue
+            while ofs <= totalsize:
+                size, digest, data = blocks.get()
+                if size is None:
+                    raise data[0], data[1], data[2]
+                if size == 0:
+                    # end of file, use offset = -1 to finalize upload
+                    offset = -1
+                    sz = ofs
                 else:
-                    raise GenericError, "Error uploading file %s, offset %d" %(name, offset)
-            if size == 0:
-                break
-            ofs += size
-            now = time.time()
-            t1 = now - lap
-            if t1 <= 0:
-                t1 = 1
-            t2 = now - started
-            if t2 <= 0:
-                t2 = 1
-            if debug:
-                print "Uploaded %d bytes in %f seconds (%f kbytes/sec)" % (size,t1,size/t1/1024)
-            if debug:
-                print "Total: %d bytes in %f seconds (%f kbytes/sec)" % (ofs,t2,ofs/t2/1024)
-            if callback:
-                callback(ofs, totalsize, size, t1, t2)
-        fo.close()
+                    offset = ofs
+                    sz = size
+                _send_block(session, recipetestid, name, sz, digest, offset, data, retries)
+                del data
+                if size == 0:
+                    break
+                ofs += size
+                now = time.time()
+                t1 = now - lap
+                lap = now
+                if t1 <= 0:
+                    t1 = 1
+                t2 = now - started
+                if t2 <= 0:
+                    t2 = 1
+                if debug:
+                    log.debug("Uploaded %d bytes in %f seconds (%f kbytes/sec)",
+                              size, t1, size/t1/1024)
+                    log.debug("Total: %d bytes in %f seconds (%f kbytes/sec)",
+                              ofs, t2, ofs/t2/1024)
+                if callback:
+                    callback(ofs, totalsize, size, t1, t2)
+        finally:
+            # Wake the reader up in case it is blocked on a full queue
+            abort.set()
+            try:
+                while True:
+                    blocks.get_nowait()
+            except Queue.Empty:
+                pass
+            reader.join()
     finally:
-        if localfile == tmpfile:
-            os.unlink(tmpfile)
-
+        fo.close()
@@ -0,0 +1,141 @@
+# Python module
+# Unit tests for the rhts upload helpers
+
+# Copyright (c) 2005-2006 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+
+import os
+import hashlib
+import tempfile
+import threading
+import unittest
+import rhts
+from rhts import uploadWrapper, GenericError
+
+class FakeUploadSession(object):
+    """
+    Stands in for the scheduler's xmlrpc proxy, checking and collecting the
+    blocks passed to results.uploadFile
+    """
+    def __init__(self, refuse=False):
+        self.refuse = refuse
+        self.blocks = {}
+        self.digests = []
+        self.finalsize = None
+
+    def __getattr__(self, name):
+        if name != 'results.uploadFile':
+            raise AttributeError(name)
+        return self.uploadFile
+
+    def uploadFile(self, recipetestid, name, sz, digest, offset, data):
+        if self.refuse:
+            return 1
+        contents = data.decode('base64')
+        self.digests.append(digest)
+        if digest and hashlib.md5(contents).hexdigest() != digest:
+            return 1
+        if offset == -1:
+            self.finalsize = sz
+        elif len(contents) != sz:
+            return 1
+        else:
+            self.blocks[offset] = contents
+        return 0
+
+    def contents(self):
+        return ''.join([self.blocks[ofs] for ofs in sorted(self.blocks)])
+
+class UploadWrapperTests(unittest.TestCase):
+    def setUp(self):
+        self.file = tempfile.NamedTemporaryFile()
+        self.threads = threading.activeCount()
+
+    def tearDown(self):
+        self.file.close()
+        # the reader thread must be gone however the upload ended
+        self.assertEquals(threading.activeCount(), self.threads)
+
+    def upload(self, contents, session=None, **kwargs):
+        self.file.write(contents)
+        self.file.flush()
+        if session is None:
+            session = FakeUploadSession()
+        uploadWrapper(session, self.file.name, 1, **kwargs)
+        return session
+
+    def test_sizes(self):
+        "Ensure files around the block size are uploaded intact"
+        for size in (0, 1, 15, 16, 17, 100):
+            self.file.truncate(0)
+            self.file.seek(0)
+            contents = os.urandom(size)
+            session = self.upload(contents, blocksize=16)
+            self.assertEquals(session.contents(), contents)
+            self.assertEquals(session.finalsize, size)
+
+    def test_start(self):
+        "Ensure an upload can resume from an offset"
+        contents = os.urandom(100)
+        session = self.upload(contents, blocksize=16, start=40)
+        self.assertEquals(session.contents(), contents[40:])
+        self.assertEquals(session.finalsize, 100)
+
+    def test_proc(self):
+        "Ensure /proc files are uploaded from a snapshot"
+        session = FakeUploadSession()
+        uploadWrapper(session, '/proc/self/status', 1)
+        self.assert_(session.finalsize > 0)
+        self.assertEquals(session.finalsize, len(session.contents()))
+
+    def test_refused(self):
+        "Ensure an error is raised when the server keeps refusing a block"
+        self.assertRaises(GenericError, self.upload, os.urandom(100),
+                FakeUploadSession(refuse=True), blocksize=16)
+
+    def test_missing_file(self):
+        "Ensure a missing file is reported"
+        self.assertRaises(IOError, uploadWrapper, FakeUploadSession(),
+                self.file.name + '.missing', 1)
+
+    def test_digests(self):
+        "Ensure each block is sent with its md5, and the final call without"
+        contents = os.urandom(40)
+        session = self.upload(contents, blocksize=16)
+        self.assertEquals(session.digests,
+                [hashlib.md5(contents[ofs:ofs+16]).hexdigest() for ofs in (0, 16, 32)] + [''])
+
+    def test_no_digests(self):
+        "Ensure digests can be turned off"
+        session = self.upload(os.urandom(40), blocksize=16, compute_digest=False)
+        self.assertEquals(session.digests, [''] * 4)
+
+    def test_md5_unavailable(self):
+        "Ensure blocks are sent without digests where md5 is disabled"
+        def md5(data):
+            raise ValueError('error:060800A3:digital envelope routines:'
+                             'EVP_DigestInit_ex:disabled for fips')
+        saved = rhts._md5
+        rhts._md5 = md5
+        try:
+            contents = os.urandom(40)
+            session = self.upload(contents, blocksize=16)
+        finally:
+            rhts._md5 = saved
+        self.assertEquals(session.contents(), contents)
+        self.assertEquals(session.digests, [''] * 4)
+
+if __name__=='__main__':
+    unittest.main()
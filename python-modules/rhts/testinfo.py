@@ -18,10 +18,10 @@
 #
 # Author: David Malcolm
 import re
+import string
 import unittest
 import tempfile
 import sys
-import codecs
 
 namespaces = [ ('desktop', ['evolution', 'openoffice.org', 'poppler', 'shared-mime-info']),
                ('tools', ['gcc']),
@@ -29,6 +29,16 @@ namespaces = [ ('desktop', ['evolution', 'openoffice.org', 'poppler', 'shared-mi
                ('cluster', []),
                ('rhn', []) ]
 
+# Patterns used while parsing, compiled once at import time:
+_RE_PROPERTY_NAME = re.compile(r'^[A-Za-z0-9]+$')
+_RE_PROPERTY_VALUE = re.compile(r'^[A-Z:a-z0-9]+$')
+_PROPERTY_OPS = frozenset(['=', '>', '>=', '<', '<='])
+_SITECONFIG_PREFIX = 'SiteConfig('
+
+# BoolValidator accepts anything starting with one of these characters,
+# e.g. "y", "yes" and "1" are all true:
+_BOOL_PREFIXES = {'y': True, '1': True, 'n': False, '0': False}
+
 def get_namespace_for_package(packageName):
     for (namespace, packages) in namespaces:
         if packageName in packages:
@@ -37,9 +47,19 @@ def get_namespace_for_package(packageName):
     # not found:
     return None
     
-class TestInfo:
+class TestInfo(object):
     """Class representing metadata about a test, suitable for outputting as a
     testinfo.desc file"""
+    __slots__ = ('test_name', 'test_description', 'test_archs', 'owner',
+                 'testversion', 'releases', 'priority', 'destructive',
+                 'license', 'confidential', 'avg_test_time', 'test_path',
+                 'requires', 'rhtsrequires', 'runfor', 'bugs', 'types',
+                 'needs', 'need_properties', 'siteconfig', 'kickstart',
+                 'options', 'environment', 'provides',
+                 # set by Parser.handle_name:
+                 'test_name_root_ns', 'test_name_under_root_ns',
+                 'expected_path_under_mnt_tests_from_name', 'test_name_frags')
+
     def __init__(self):
         self.test_name = None
         self.test_description = None
@@ -66,84 +86,98 @@ class TestInfo:
         self.environment = {}
         self.provides = []
 
-    def output_string_field(self, file, fileFieldName, dictFieldName):
-        value = self.__dict__[dictFieldName]
+    def output_string_field(self, lines, fileFieldName, dictFieldName):
+        value = getattr(self, dictFieldName)
         if value:
-            file.write(u'%s: %s\n'%(fileFieldName, value))
+            lines.append(u'%s: %s\n'%(fileFieldName, value))
 
-    def output_string_list_field(self, file, fileFieldName, dictFieldName):
-        value = self.__dict__[dictFieldName]
+    def output_string_list_field(self, lines, fileFieldName, dictFieldName):
+        value = getattr(self, dictFieldName)
         if value:
-            file.write(u'%s: %s\n'%(fileFieldName, u' '.join(value)))
+            lines.append(u'%s: %s\n'%(fileFieldName, u' '.join(value)))
 
-    def output_string_dict_field(self, file, fileFieldName, dictFieldName):
-        value = self.__dict__[dictFieldName]
+    def output_string_dict_field(self, lines, fileFieldName, dictFieldName):
+        value = getattr(self, dictFieldName)
         if value:
             for key, val in value.items():
                 if val:
-                    file.write(u'%s: %s=%s\n'%(fileFieldName, key, val))
+                    lines.append(u'%s: %s=%s\n'%(fileFieldName, key, val))
 
-    def output_bool_field(self, file, fileFieldName, dictFieldName):        
-        value = self.__dict__[dictFieldName]
+    def output_bool_field(self, lines, fileFieldName, dictFieldName):        
+        value = getattr(self, dictFieldName)
         if value is not None:
             if value:
                 strValue = u"yes"
             else:
                 strValue = u"no"
-            file.write(u'%s: %s\n'%(fileFieldName, strValue))
+            lines.append(u'%s: %s\n'%(fileFieldName, strValue))
+
+    # Fields written out by output(), in order, with the name of the method
+    # used to format each (looked up per instance, so subclasses can override):
+    _OUTPUT_FIELDS = (
+        (u'Name', u'test_name', 'output_string_field'),
+        (u'Description', u'test_description', 'output_string_field'),
+        (u'Architectures', u'test_archs', 'output_string_list_field'),
+        (u'Owner', u'owner', 'output_string_field'),
+        (u'TestVersion', u'testversion', 'output_string_field'),
+        (u'Releases', u'releases', 'output_string_list_field'),
+        (u'Priority', u'priority', 'output_string_field'),
+        (u'Destructive', u'destructive', 'output_bool_field'),
+        (u'License', u'license', 'output_string_field'),
+        (u'Confidential', u'confidential', 'output_bool_field'),
+        (u'TestTime', u'avg_test_time', 'output_string_field'),
+        (u'Path', u'test_path', 'output_string_field'),
+        (u'Requires', u'requires', 'output_string_list_field'),
+        (u'RhtsRequires', u'rhtsrequires', 'output_string_list_field'),
+        (u'RunFor', u'runfor', 'output_string_list_field'),
+        (u'Bugs', u'bugs', 'output_string_list_field'),
+        (u'Type', u'types', 'output_string_list_field'),
+        (u'RhtsOptions', u'options', 'output_string_list_field'),
+        (u'Environment', u'environment', 'output_string_dict_field'),
+        (u'Provides', u'provides', 'output_string_list_field'),
+        )
 
     def output(self, file):
         """
         Write out a testinfo.desc to the file object
         """
-        file = codecs.getwriter('utf8')(file)
-        self.output_string_field(file, u'Name', u'test_name')
-        self.output_string_field(file, u'Description', u'test_description')
-        self.output_string_list_field(file, u'Architectures', u'test_archs')
-        self.output_string_field(file, u'Owner', u'owner')
-        self.output_string_field(file, u'TestVersion', u'testversion')
-        self.output_string_list_field(file, u'Releases', u'releases')
-        self.output_string_field(file, u'Priority', u'priority')
-        self.output_bool_field(file, u'Destructive', u'destructive')
-        self.output_string_field(file, u'License', u'license')
-        self.output_bool_field(file, u'Confidential', u'confidential')
-        self.output_string_field(file, u'TestTime', u'avg_test_time')
-        self.output_string_field(file, u'Path', u'test_path')
-        self.output_string_list_field(file, u'Requires', u'requires')
-        self.output_string_list_field(file, u'RhtsRequires', u'rhtsrequires')
-        self.output_string_list_field(file, u'RunFor', u'runfor')
-        self.output_string_list_field(file, u'Bugs', u'bugs')
-        self.output_string_list_field(file, u'Type', u'types')
-        self.output_string_list_field(file, u'RhtsOptions', u'options')
-        self.output_string_dict_field(file, u'Environment', u'environment')
-        self.output_string_list_field(file, u'Provides', u'provides')
+        # Collect the lines and write them out UTF-8 encoded in one go
+        lines = []
+        for (fileFieldName, dictFieldName, methodName) in self._OUTPUT_FIELDS:
+            getattr(self, methodName)(lines, fileFieldName, dictFieldName)
         for (name, op, value) in self.need_properties:
-            file.write(u'NeedProperty: %s %s %s\n'%(name, op, value))
-        file.write(self.generate_siteconfig_lines())
+            lines.append(u'NeedProperty: %s %s %s\n'%(name, op, value))
+        lines.append(self.generate_siteconfig_lines())
+        file.write(u''.join(lines).encode('utf8'))
         
     def generate_siteconfig_lines(self):
-        result = ""
+        result = []
+        name = self.test_name
+        prefix_len = len(name or '') + 1
         for (arg, description) in self.siteconfig:
-            if self.test_name:
-                if arg.startswith(self.test_name):
-                    # Strip off common prefix:
-                    arg = arg[len(self.test_name)+1:]
-            result += u'SiteConfig(%s): %s\n'%(arg, description)
-        return result
+            if name and arg.startswith(name):
+                # Strip off common prefix:
+                arg = arg[prefix_len:]
+            result.append(u'SiteConfig(%s): %s\n'%(arg, description))
+        return u''.join(result)
         
-class Validator:
+class Validator(object):
     """
     Abstract base class for validating fields
     """
-    pass
+    __slots__ = ()
 
 class RegexValidator(Validator):
+    __slots__ = ('pattern', 'regex', 'msg')
+    flags = 0
+
     def __init__(self, pattern, message):
         self.pattern = pattern
+        self.regex = re.compile(pattern, self.flags)
         self.msg = message
 
     def is_valid(self, value):
-        return re.match(self.pattern, value)
+        return self.regex.match(value)
 
     def message(self):
         return self.msg
@@ -153,12 +187,13 @@ class UnicodeRegexValidator(RegexValidator):
     Validates against a regexp pattern but with the re.UNICODE flag applied
     so that character classes like \w have their "Unicode-aware" meaning.
     """
-    def is_valid(self, value):
-        return re.match(self.pattern, value, re.UNICODE)
+    __slots__ = ()
+    flags = re.UNICODE
 
 # This is specified in RFC2822 Section 3.4, 
 # we accept only the most common variations
 class NameAddrValidator(UnicodeRegexValidator):
+    __slots__ = ()
 
     ATOM_CHARS = r"\w!#$%&'\*\+-/=?^_`{|}~"
     PHRASE = r' *[%s][%s ]*' % (ATOM_CHARS, ATOM_CHARS)
@@ -171,6 +206,8 @@ class NameAddrValidator(UnicodeRegexValidator):
                 'such as John Doe <jdoe@somedomain.org>')
 
 class ListValidator(Validator):
+    __slots__ = ('validValues',)
+
     def __init__(self, validValues):
         self.validValues = validValues
 
@@ -178,12 +215,11 @@ class ListValidator(Validator):
         return value in self.validValues
 
     def message(self):
-        errorMsg = 'valid values are'
-        for value in self.validValues:
-            errorMsg += ' "%s"'%value
-        return errorMsg
+        return 'valid values are' + ''.join([' "%s"'%value for value in self.validValues])
 
 class DashListValidator(ListValidator):
+    __slots__ = ()
+
     def is_valid(self, value):
         if value.startswith('-'):
             value = value[1:]
@@ -193,78 +229,127 @@ class DashListValidator(ListValidator):
         return ListValidator.message(self) + " optionally prefixed with '-'"
 
 class BoolValidator(Validator):
+    __slots__ = ()
+
     def __init__(self):
         pass
 
     def convert(self, value):
-        if re.match("y|yes|1", value):
-            return True
-
-        if re.match("n|no|0", value):
-            return False
-
-        return None
+        return _BOOL_PREFIXES.get(value[:1])
 
     def is_valid(self, value):
-        return self.convert(value) is not None
+        return value[:1] in _BOOL_PREFIXES
 
     def message(self):
         return "boolean value expected"
 
+# Validators which don't depend on parser configuration, compiled once at import time:
+_OWNER_VALIDATOR = NameAddrValidator()
+_TESTVERSION_VALIDATOR = RegexValidator(r'^([A-Za-z0-9\.]*)$',
+        'can only contain numbers, letters and the dot symbol')
+_ENVIRONMENT_KEY_VALIDATOR = RegexValidator(r'^([A-Za-z_][A-Za-z0-9_]*)$',
+        'Can contain only letters, numbers and underscore.')
 
 class Parser:
     """
     Parser for testinfo.desc files
     """
+    # Map from field names to the names of their value-parsing methods:
+    _FIELD_HANDLERS = (
+        ('Name', 'handle_name'),
+        ('Description', 'handle_desc'),
+        ('Notify', 'handle_deprecated'),
+        ('Owner', 'handle_owner'),
+        ('TestVersion', 'handle_testversion'),
+        ('License', 'handle_license'),
+        ('Releases', 'handle_releases'),
+        ('Architectures', 'handle_archs'),
+        ('RhtsOptions', 'handle_options'),
+        ('Environment', 'handle_environment'),
+        ('Priority', 'handle_priority'),
+        ('Destructive', 'handle_destructive'),
+        ('Confidential', 'handle_confidential'),
+        ('TestTime', 'handle_testtime'),
+        ('Type', 'handle_type'),
+        ('Bug', 'handle_bug'),
+        ('Bugs', 'handle_bug'),
+        ('Path', 'handle_path'),
+        ('RunFor', 'handle_runfor'),
+        ('Requires', 'handle_requires'),
+        ('RhtsRequires', 'handle_rhtsrequires'),
+        ('NeedProperty', 'handle_needproperty'),
+        ('Need', 'handle_deprecated_for_needproperty'),
+        ('Want', 'handle_deprecated_for_needproperty'),
+        ('WantProperty', 'handle_deprecated_for_needproperty'),
+        ('Kickstart', 'handle_kickstart'),
+        ('Provides', 'handle_provides'),
+        )
+
+    # Fields which must be present, and the TestInfo attributes holding them:
+    _MANDATORY_FIELDS = (
+        ('Name', 'test_name'),
+        ('Description', 'test_description'),
+        ('Path', 'test_path'),
+        ('TestTime', 'avg_test_time'),
+        ('TestVersion', 'testversion'),
+        ('License', 'license'),
+        ('Owner', 'owner'),
+        )
+
+    # All of these could be populated based on a DB query if we wanted to structure things that way:
+    valid_root_ns = [
+        'distribution', 
+        'installation', 
+        'kernel', 
+        'desktop', 
+        'tools', 
+        'CoreOS', 
+        'cluster', 
+        'rhn', 
+        'examples',
+        'performance',
+        'ISV',
+        'virt'
+        ]
+    
+    root_ns_with_mnt_tests_subtree = ['distribution', 'kernel']
+    
+    valid_architectures = [
+        'ia64', 
+        'x86_64', 
+        'ppc', 
+        'ppc64', 
+        'ppc64le',
+        's390', 
+        's390x', 
+        'i386',
+        'aarch64',
+        'arm',
+        'armhfp',
+        ]
+    
+    valid_priorities = [
+        'Low', 
+        'Medium', 
+        'Normal', 
+        'High', 
+        'Manual'
+        ]
+
+    valid_options = [
+        'Compatible',
+        'CompatService',
+        'StrongerAVC',
+        ]
+
+    # BoolValidator has no configuration, so it is shared by all parsers:
+    _bool_validator = BoolValidator()
+
     def __init__(self):
         self.info = TestInfo()
+        self._fields = dict([(fileFieldName, getattr(self, methodName))
+                             for (fileFieldName, methodName) in self._FIELD_HANDLERS])
 
-        # All of these could be populated based on a DB query if we wanted to structure things that way:
-        self.valid_root_ns = [
-            'distribution', 
-            'installation', 
-            'kernel', 
-            'desktop', 
-            'tools', 
-            'CoreOS', 
-            'cluster', 
-            'rhn', 
-            'examples',
-            'performance',
-            'ISV',
-            'virt'
-            ]
-        
-        self.root_ns_with_mnt_tests_subtree = ['distribution', 'kernel']
-        
-        self.valid_architectures = [
-            'ia64', 
-            'x86_64', 
-            'ppc', 
-            'ppc64', 
-            'ppc64le',
-            's390', 
-            's390x', 
-            'i386',
-            'aarch64',
-            'arm',
-            'armhfp',
-            ]
-        
-        self.valid_priorities = [
-            'Low', 
-            'Medium', 
-            'Normal', 
-            'High', 
-            'Manual'
-            ]
-
-        self.valid_options = [
-            'Compatible',
-            'CompatService',
-            'StrongerAVC',
-            ]
-        
     def handle_error(self, message):
         raise NotImplementedError
 
@@ -273,27 +358,21 @@ class Parser:
 
     def error_if_not_in_array(self, fieldName, value, validValues):
         if not value in validValues:
-            errorMsg = '"%s" is not a valid value for %s; valid values are'%(value, fieldName);
-            for validValue in validValues:
-                errorMsg += ' "%s"'%validValue
-            self.handle_error(errorMsg)
-
-    def __mandatory_field(self, fileFieldName, dictFieldName):
-        if not self.info.__dict__[dictFieldName]:
-            self.handle_error("%s field not defined"%fileFieldName)
+            self.handle_error('"%s" is not a valid value for %s; valid values are%s'
+                    % (value, fieldName, ''.join([' "%s"'%v for v in validValues])))
 
     def __unique_field(self, fileFieldName, dictFieldName, value, validator=None):
-        if self.info.__dict__[dictFieldName]:
+        if getattr(self.info, dictFieldName):
             self.handle_error("%s field already defined"%fileFieldName)
 
-        self.info.__dict__[dictFieldName] = value
+        setattr(self.info, dictFieldName, value)
 
         if validator:
             if not validator.is_valid(value):
                 self.handle_error('"%s" is not a valid %s field (%s)'%(value, fileFieldName, validator.message()))
 
     def __bool_field(self, fileFieldName, dictFieldName, raw_value):
-        validator = BoolValidator()
+        validator = self._bool_validator
         if not validator.is_valid(raw_value):
             self.handle_error('"%s" is not a valid %s field (%s)'
                     % (raw_value, fileFieldName, validator.message()))
@@ -301,13 +380,12 @@ class Parser:
         self.__unique_field(fileFieldName, dictFieldName, value)
 
     def _handle_dict(self, fileFieldName, dictFieldName, value, validator=None, key_validator=None):
-        kv = value.split("=", 1)
-        if len(kv) < 2:
+        (k, sep, v) = value.partition("=")
+        if not sep:
             self.handle_error("Malformed %s field not matching KEY=VALUE pattern" % fileFieldName)
             return
-        k, v = kv
         d = getattr(self.info, dictFieldName)
-        if d.has_key(k):
+        if k in d:
             self.handle_error("%s: Duplicate entry for %r" % (fileFieldName, k))
             return
         if key_validator and not key_validator.is_valid(k):
@@ -316,27 +394,33 @@ class Parser:
         if validator and not validator.is_valid(v):
             self.handle_error('"%s" is not a valid %s field (%s)'%(v, fileFieldName, validator.message()))
             return
-        d[k] = kv[1]
+        d[k] = v
 
-    def _handle_unique_list(self, fileFieldName, dictFieldName, value, validator=None, split_at=" "):
+    def _handle_list(self, dictFieldName, value):
+        getattr(self.info, dictFieldName).extend(value.split())
+
+    def _handle_unique_list(self, fileFieldName, dictFieldName, value, validator=None,
+                            split_at=None):
         l = getattr(self.info, dictFieldName)
         if l:
             self.handle_error("%s field already defined"%fileFieldName)
             return
         items = value.split(split_at)
         if validator:
+            is_valid = validator.is_valid
+            append = l.append
             for item in items:
-                if not validator.is_valid(item):
+                if not is_valid(item):
                     self.handle_error('"%s" is not a valid %s field (%s)'%(item, fileFieldName, validator.message()))
                     continue
-                l.append(item)
+                append(item)
         else:
             l.extend(items)
 
     def handle_name(self, key, value):
         self.__unique_field(key, 'test_name', value)
 
-        if not re.match('^/', value):
+        if not value.startswith('/'):
             self.handle_error("Name field does not begin with a forward-slash")
             return
                 
@@ -357,10 +441,10 @@ class Parser:
     def handle_owner(self, key, value):
         # Required one-only email addresses "John Doe <someone@some.domain.org>"
         # In theory this could be e.g. memo-list@redhat.com; too expensive to check for that here
-        self.__unique_field(key, 'owner', value, NameAddrValidator())
+        self.__unique_field(key, 'owner', value, _OWNER_VALIDATOR)
 
     def handle_testversion(self, key, value):
-        self.__unique_field(key, 'testversion', value, RegexValidator(r'^([A-Za-z0-9\.]*)$', 'can only contain numbers, letters and the dot symbol'))
+        self.__unique_field(key, 'testversion', value, _TESTVERSION_VALIDATOR)
         # FIXME: we can probably support underscores as well
 
     def handle_license(self, key, value):
@@ -375,31 +459,27 @@ class Parser:
         num_negative_releases = 0
         num_positive_releases = 0
 
-        releases = []
-        for release in value.split(" "):
-            #print "Got release: release"
-
-            releases.append(release)
-            m = re.match('^-(.*)', release)
-            if m:
-                cleaned_release = m.group(1)
-                # print "Got negative release: %s"%cleaned_release
+        releases = value.split()
+        for release in releases:
+            if release.startswith('-'):
                 num_negative_releases+=1
             else:
-                cleaned_release = release
-                # print "Got positive release: %s"%release
                 num_positive_releases+=1
 
-            if num_negative_releases>0 and num_positive_releases>0:
-                self.handle_warning("Releases field lists both negated and non-negated release names (should be all negated, or all non-negated)")
+        if num_negative_releases>0 and num_positive_releases>0:
+            self.handle_warning("Releases field lists both negated and non-negated release names "
+                                "(should be all negated, or all non-negated)")
         self.info.releases = releases
 
     def handle_archs(self, key, value):
         self.__unique_field(key, 'test_archs', value)
 
         archs = []
-        for arch in value.split(" "):
-            self.error_if_not_in_array("Architecture", arch.lstrip('-'), self.valid_architectures)
+        valid_archs = self.valid_architectures
+        for arch in value.split():
+            name = arch.lstrip('-')
+            if name not in valid_archs:
+                self.error_if_not_in_array("Architecture", name, valid_archs)
             archs.append(arch)
         if any(arch.startswith('-') for arch in archs) and not all(arch.startswith('-') for arch in archs):
             self.handle_warning("Architectures field lists both negated and non-negated architectures (should be all negated, or all non-negated)")
@@ -409,7 +489,7 @@ class Parser:
         self._handle_unique_list(key, 'options', value, DashListValidator(self.valid_options))
 
     def handle_environment(self, key, value):
-        self._handle_dict(key, 'environment', value, key_validator=RegexValidator(r'^([A-Za-z_][A-Za-z0-9_]*)$', 'Can contain only letters, numbers and underscore.'))
+        self._handle_dict(key, 'environment', value, key_validator=_ENVIRONMENT_KEY_VALIDATOR)
 
     def handle_priority(self, key, value):
         self.__unique_field(key, 'priority', value, ListValidator(self.valid_priorities))
@@ -426,10 +506,10 @@ class Parser:
             return
 
         # TestTime is an integer with an optional minute (m) or hour (h) suffix
-        m = re.match('^(\d+)(.*)$', value)
-        if m:
-            self.info.avg_test_time = int(m.group(1))
-            suffix = m.group(2)
+        suffix = value.lstrip(string.digits)
+        number = value[:len(value) - len(suffix)]
+        if number:
+            self.info.avg_test_time = int(number)
             if suffix == '':
                 pass # no units means seconds
             elif suffix == 'm':
@@ -447,19 +527,17 @@ class Parser:
             self.handle_error("Malformed %s field"%key)
 
     def handle_type(self, key, value):
-        for type in value.split(" "):
-            self.info.types.append(type)
+        self._handle_list('types', value)
     
     def handle_kickstart(self, key, value):
         self.info.kickstart = value
     
     def handle_bug(self, key, value):
-        for bug in value.split(" "):
-            # print "Got bug: %s"%bug
-
-            m = re.match('^([1-9][0-9]*)$', bug)
-            if m:
-                self.info.bugs.append(int(m.group(1)))
+        append = self.info.bugs.append
+        for bug in value.split():
+            # A bug number is all ASCII digits with no leading zero:
+            if bug[0] != '0' and not bug.lstrip(string.digits):
+                append(int(bug))
             else:
                 self.handle_error('"%s" is not a valid Bug value (should be numeric)'%bug)
                 
@@ -467,10 +545,10 @@ class Parser:
         if self.info.test_path:
             self.handle_error("Path field already defined")
 
-        if re.match(r'^\/mnt\/tests\/', value):
+        if value.startswith('/mnt/tests/'):
             absolute_path = value
         else:
-            if re.match(r'^\/', value):
+            if value.startswith('/'):
                 self.handle_error("Path field is absolute but is not below /mnt/tests")
 
             # Relative path:
@@ -492,26 +570,25 @@ class Parser:
 #
 
     def handle_runfor(self, key, value):
-        for pkgname in value.split(" "):
-            self.info.runfor.append(pkgname)
+        self._handle_list('runfor', value)
 
     def handle_requires(self, key, value):
-        for pkgname in value.split(" "):
-            self.info.requires.append(pkgname)
+        self._handle_list('requires', value)
 
     def handle_rhtsrequires(self, key, value):
-        for pkgname in value.split(" "):
-            self.info.rhtsrequires.append(pkgname)
+        self._handle_list('rhtsrequires', value)
 
     def handle_provides(self, key, value):
-        for pkgname in value.split(" "):
-            self.info.provides.append(pkgname)
+        self._handle_list('provides', value)
 
     def handle_needproperty(self, key, value):
-        m = re.match(r'^([A-Za-z0-9]*)\s+(=|>|>=|<|<=)\s+([A-Z:a-z0-9]*)$', value)
-        if m:
+        # PROPERTYNAME OP PROPERTYVALUE
+        parts = value.split()
+        if len(parts) == 3 and parts[1] in _PROPERTY_OPS \
+                and _RE_PROPERTY_NAME.match(parts[0]) \
+                and _RE_PROPERTY_VALUE.match(parts[2]):
             self.info.needs.append(value)
-            self.info.need_properties.append((m.group(1), m.group(2), m.group(3)))
+            self.info.need_properties.append(tuple(parts))
         else:
             self.handle_error('"%s" is not a valid %s field; %s'%(value, key, "must be of the form PROPERTYNAME {=|>|>=|<|<=} PROPERTYVALUE"))
 
@@ -519,7 +596,7 @@ class Parser:
         self.handle_error("%s field is deprecated.  Use NeedProperty instead"%key)
 
     def __handle_siteconfig(self, arg, value):
-        if re.match('^/.*', arg):
+        if arg.startswith('/'):
             # Absolute path:
             absPath = arg
         else:
@@ -539,38 +616,11 @@ class Parser:
         if decl=="SiteConfig":
             self.__handle_siteconfig(arg, value)
         else:
-            self.handle_error('"%s" is not a valid declaration"')
+            self.handle_error('"%s" is not a valid declaration'%decl)
         
     def parse(self, lines):
-        # Map from field names to value-parsing methods:
-        fields = {'Name' : self.handle_name,
-                  'Description' : self.handle_desc,
-                  'Notify' : self.handle_deprecated,
-                  'Owner' : self.handle_owner,
-                  'TestVersion' : self.handle_testversion,
-                  'License' : self.handle_license,
-                  'Releases': self.handle_releases,
-                  'Architectures': self.handle_archs,
-                  'RhtsOptions': self.handle_options,
-                  'Environment': self.handle_environment,
-                  'Priority': self.handle_priority,
-                  'Destructive': self.handle_destructive,
-                  'Confidential': self.handle_confidential,
-                  'TestTime': self.handle_testtime,
-                  'Type': self.handle_type,
-                  'Bug': self.handle_bug,
-                  'Bugs': self.handle_bug,
-                  'Path': self.handle_path,
-                  'RunFor': self.handle_runfor,
-                  'Requires': self.handle_requires,
-                  'RhtsRequires': self.handle_rhtsrequires,
-                  'NeedProperty': self.handle_needproperty,
-                  'Need': self.handle_deprecated_for_needproperty,
-                  'Want': self.handle_deprecated_for_needproperty,
-                  'WantProperty': self.handle_deprecated_for_needproperty,
-                  'Kickstart': self.handle_kickstart,
-                  'Provides': self.handle_provides,
-                  }
+        get_handler = self._fields.get
+        handle_error = self.handle_error
 
         self.lineNum = 0;
         for line in lines:
@@ -578,50 +628,55 @@ class Parser:
 
             # print $line_num," ",$line;
 
-            # Skip comment lines:
-            if re.match('^#', line):
-                continue
-
             line = line.strip()
- 
-            # Skip pure whitespace:
-            if line=='':
+
+            # Skip pure whitespace and comment lines:
+            if not line or line[0] == '#':
                 continue
 
-            # Handle declarations e.g. "SiteConfig(server):  hostname of server"
-            m = re.match('([^:]*)\((.*)\):(.*)', line)
-            if m:
-                (decl, arg, value) = (m.group(1), m.group(2), m.group(3))
+            # SiteConfig is the only declaration in use, so look for it before
+            # splitting the line up.  It is split the same way as the general
+            # case below: the last "(" before the first colon must be the one
+            # ending the prefix.
+            if line.startswith(_SITECONFIG_PREFIX):
+                start = len(_SITECONFIG_PREFIX)
+                colon = line.find(':')
+                close = line.rfind('):')
+                if colon != -1 and close >= start \
+                        and line.rfind('(', start, colon) == -1:
+                    self.__handle_siteconfig(line[start:close].strip(),
+                                             line[close+2:].strip())
+                    continue
 
-                # Deal with it, stripping whitespace:
-                self.__handle_declaration(decl, arg.strip(), value.strip())
+            (key, sep, value) = line.partition(':')
+            if not sep:
+                handle_error("Malformed \"Key: value\" line")
                 continue
 
-            # Handle key/value pairs e.g.: "Bug: 123456"
-            m = re.match('([^:]*):(.*)', line)
-            if not m:
-                self.handle_error("Malformed \"Key: value\" line")
-                continue
-            
-            (key, value) = (m.group(1), m.group(2))
-            
-            # Strip leading and trailing whitespace:
-            value = value.strip()
+            # Handle declarations e.g. "SiteConfig(server):  hostname of server"
+            # i.e. the last "(" before the first colon, up to the last "):"
+            paren = key.rfind('(')
+            if paren != -1:
+                close = line.rfind('):')
+                if close > paren:
+                    # Deal with it, stripping whitespace:
+                    self.__handle_declaration(key[:paren], line[paren+1:close].strip(),
+                                              line[close+2:].strip())
+                    continue
 
+            # Handle key/value pairs e.g.: "Bug: 123456"
             # Note that I'm not quoting the values; this isn't talking direct to a DB
-            if key in fields:
-                handler = fields[key]
-                handler(key, value)
+            handler = get_handler(key)
+            if handler:
+                # Strip leading and trailing whitespace:
+                handler(key, value.strip())
 
         # Postprocessing:
 	# Ensure mandatory fields have values:
-        self.__mandatory_field('Name', 'test_name')
-        self.__mandatory_field('Description', 'test_description')
-        self.__mandatory_field('Path', 'test_path')
-        self.__mandatory_field('TestTime', 'avg_test_time')
-        self.__mandatory_field('TestVersion', 'testversion')
-        self.__mandatory_field('License', 'license')
-        self.__mandatory_field('Owner', 'owner')
+        info = self.info
+        for (fileFieldName, dictFieldName) in self._MANDATORY_FIELDS:
+            if not getattr(info, dictFieldName):
+                handle_error("%s field not defined"%fileFieldName)
 
 #
 #	my $expected_path_under_mnt_tests = $test{test_name_under_root_ns};
@@ -769,14 +824,15 @@ def parse_string(string, raise_errors = True):
     if isinstance(string, str):
         # Callers should always pass unicode for consistency, this is just to 
         # be forgiving so we don't break anyone unexpectedly.
-        string = str.decode('utf8')
+        string = string.decode('utf8')
     p = StrictParser(raise_errors)
-    p.parse(string.split("\n"))
+    p.parse(string.splitlines())
     return p.info
 
 def parse_file(filename, raise_errors = True):
     p = StrictParser(raise_errors)
-    p.parse(codecs.open(filename, 'r', 'utf8').readlines())
+    with open(filename, 'rb') as fd:
+        p.parse(fd.read().decode('utf8').splitlines())
     return p.info
 
 #class ParserTests(unittest.TestCase):
@@ -824,18 +880,69 @@ class DescriptionFieldTests(unittest.TestCase):
         ti = parse_string(u"Description: This test is from http://foo/bar", raise_errors=False)
         self.assertEquals(ti.test_description, u"This test is from http://foo/bar")
 
+    def test_description_with_parentheses(self):
+        "Ensure Description field containing parentheses and a colon is parsed correctly"
+        ti = parse_string(u"Description: Checks that foo(1): returns bar", raise_errors=False)
+        self.assertEquals(ti.test_description, u"Checks that foo(1): returns bar")
+
+class ParseStringTests(unittest.TestCase):
+    def test_byte_string(self):
+        "Ensure a UTF-8 encoded byte string is decoded before parsing"
+        ti = parse_string("Owner: J\xc3\xb6rg <jorg@example.com>", raise_errors=False)
+        self.assertEquals(ti.owner, u"J\xf6rg <jorg@example.com>")
+
+class MalformedLineTests(unittest.TestCase):
+    def test_line_without_colon(self):
+        "Ensure a line that is not of the form Key: value is reported"
+        self.assertRaises(ParserError, parse_string, u"Just some text", raise_errors=True)
+
+    def test_indented_comment(self):
+        "Ensure an indented comment line is skipped rather than reported"
+        ti = parse_string(u"""
+        # Just some text
+        Owner:        Jane Doe <jdoe@redhat.com>
+        Name:         /examples/coreutils/example-simple-test
+        Path:         /mnt/tests/examples/coreutils/example-simple-test
+        Description:  This test ensures that comments can be indented
+        TestTime:     1m
+        TestVersion:  1.1
+        License:      GPL
+        """, raise_errors=True)
+        self.assertEquals(ti.owner, u"Jane Doe <jdoe@redhat.com>")
+
 class ReleasesFieldTests(unittest.TestCase):
     def test_releases(self):
         "Ensure Releases field is parsed correctly"
         ti = parse_string(u"Releases: FC5 FC6", raise_errors=False)
         self.assertEquals(ti.releases, [u'FC5', u'FC6'])
 
+    def test_mixed_releases(self):
+        "Ensure mixing negated and non-negated releases is warned about"
+        self.assertRaises(ParserWarning, parse_string, u"Releases: FC5 -FC6", raise_errors=True)
+
 class ArchitecturesFieldTests(unittest.TestCase):
     def test_architectures(self):
         "Ensure Architectures field is parsed correctly"
         ti = parse_string(u"Architectures: i386 x86_64", raise_errors=False)
         self.assertEquals(ti.test_archs, [u"i386", u"x86_64"])
 
+    def test_invalid_architecture(self):
+        "Ensure an unknown architecture is reported"
+        self.assertRaises(ParserError, parse_string, u"Architectures: i386 vax", raise_errors=True)
+
+    def test_blank_architectures(self):
+        "Ensure a blank Architectures field is empty rather than an error"
+        parser = StrictParser(raise_errors=True)
+        parser.handle_archs('Architectures', u'')
+        self.assertEquals(parser.info.test_archs, [])
+
+    def test_architectures_after_blank(self):
+        "Ensure a blank Architectures field does not count as already defined"
+        parser = StrictParser(raise_errors=True)
+        parser.handle_archs('Architectures', u'')
+        parser.handle_archs('Architectures', u'i386 x86_64')
+        self.assertEquals(parser.info.test_archs, [u"i386", u"x86_64"])
+
     def test_architectures_after_releases(self):
         "Ensure that an Architectures field following a Releases field is parsed correctly"
         ti = parse_string(u"""
@@ -844,6 +951,44 @@ class ArchitecturesFieldTests(unittest.TestCase):
         self.assertEquals(ti.releases, [u'FC5', u'FC6'])
         self.assertEquals(ti.test_archs, [u"i386", u"x86_64"])
 
+class ParserSubclassTests(unittest.TestCase):
+    class RestrictedParser(StrictParser):
+        valid_architectures = ['riscv64']
+        valid_priorities = ['Low', 'Urgent']
+        valid_options = ['Compatible']
+
+    def test_subclass_architectures(self):
+        "Ensure a subclass can replace the valid architectures"
+        parser = self.RestrictedParser(raise_errors=True)
+        parser.handle_archs('Architectures', u'riscv64')
+        self.assertEquals(parser.info.test_archs, [u'riscv64'])
+        parser = self.RestrictedParser(raise_errors=True)
+        self.assertRaises(ParserError, parser.handle_archs, 'Architectures', u'x86_64')
+
+    def test_subclass_priorities(self):
+        "Ensure a subclass can replace the valid priorities"
+        parser = self.RestrictedParser(raise_errors=True)
+        parser.handle_priority('Priority', u'Urgent')
+        self.assertEquals(parser.info.priority, u'Urgent')
+        parser = self.RestrictedParser(raise_errors=True)
+        self.assertRaises(ParserError, parser.handle_priority, 'Priority', u'High')
+
+    def test_subclass_list_handler(self):
+        "Ensure a subclass can override the handler of a list field"
+        class LowercaseRequiresParser(StrictParser):
+            def handle_requires(self, key, value):
+                StrictParser.handle_requires(self, key, value.lower())
+        parser = LowercaseRequiresParser(raise_errors=False)
+        parser.parse([u"Requires: openCryptoki Dogtail"])
+        self.assertEquals(parser.info.requires, [u'opencryptoki', u'dogtail'])
+
+    def test_instance_options(self):
+        "Ensure the valid options can be replaced on a parser instance"
+        parser = StrictParser(raise_errors=True)
+        parser.valid_options = ['Compatible', 'Custom']
+        parser.handle_options('RhtsOptions', u'-Custom')
+        self.assertEquals(parser.info.options, [u'-Custom'])
+
 class RhtsOptionsFieldTests(unittest.TestCase):
     def test_rhtsoptions(self):
         "Ensure RhtsOptions field is parsed correctly"
@@ -868,6 +1013,12 @@ class RhtsOptionsFieldTests(unittest.TestCase):
         "Ensure RhtsOptions field captures duplicate entries"
         self.assertRaises(ParserError, parse_string, u"RhtsOptions: Compatible\nRhtsOptions: -Compatible", raise_errors=True)
 
+    def test_blank_rhtsoptions(self):
+        "Ensure a blank RhtsOptions field is empty rather than an error"
+        parser = StrictParser(raise_errors=True)
+        parser.handle_options('RhtsOptions', u'')
+        self.assertEquals(parser.info.options, [])
+
 class EnvironmentFieldTests(unittest.TestCase):
     def test_environment(self):
         "Ensure Environment field is parsed correctly"
@@ -939,6 +1090,14 @@ class BugFieldTests(unittest.TestCase):
         Bug: 987654 456789""", raise_errors=False)
         self.assertEquals(ti.bugs, [123456, 456123, 987654, 456789])
 
+    def test_invalid_bug(self):
+        "Ensure a non-numeric Bug value is reported"
+        self.assertRaises(ParserError, parse_string, u"Bug: 123456 abc", raise_errors=True)
+
+    def test_bug_with_leading_zero(self):
+        "Ensure a Bug value with a leading zero is reported"
+        self.assertRaises(ParserError, parse_string, u"Bug: 0123456", raise_errors=True)
+
     def test_blank_bug(self):
         "Ensure a blank Bug field is handled"
         ti = parse_string(u"Bug: ", raise_errors=False)
@@ -972,12 +1131,25 @@ class TestTimeFieldTests(unittest.TestCase):
         ti = parse_string(u"TestTime: 2h", raise_errors=False)
         self.assertEquals(ti.avg_test_time, (2*60*60))
 
+    def test_testtime_bad_unit(self):
+        "Ensure an unknown TestTime unit is warned about"
+        self.assertRaises(ParserWarning, parse_string, u"TestTime: 5d", raise_errors=True)
+
+    def test_testtime_malformed(self):
+        "Ensure a TestTime not starting with a number is reported"
+        self.assertRaises(ParserError, parse_string, u"TestTime: soon", raise_errors=True)
+
 class RequiresFieldTests(unittest.TestCase):
     def test_single_line_requires(self):
         "Ensure Requires field is parsed correctly"
         ti = parse_string(u"Requires: evolution dogtail", raise_errors=False)
         self.assertEquals(ti.requires, [u'evolution', u'dogtail'])
 
+    def test_requires_with_extra_whitespace(self):
+        "Ensure runs of whitespace in the Requires field do not produce empty entries"
+        ti = parse_string(u"Requires: evolution   dogtail\tpython", raise_errors=False)
+        self.assertEquals(ti.requires, [u'evolution', u'dogtail', u'python'])
+
     def test_multiline_requires(self):
         "Ensure we can handle multiple Requires lines"
         ti = parse_string(u"""Requires: evolution dogtail
@@ -1027,11 +1199,28 @@ class NeedPropertyFieldTests(unittest.TestCase):
         """, raise_errors=False)
         self.assertEquals(ti.need_properties, [(u"CAKE", u"=", u"CHOCOLATE"), (u"SLICES", u">", u"3")])
 
+    def test_two_character_operator(self):
+        "Ensure NeedProperty accepts the two-character operators"
+        ti = parse_string(u"NeedProperty: MEMORY >= 2048", raise_errors=False)
+        self.assertEquals(ti.need_properties, [(u"MEMORY", u">=", u"2048")])
+
+    def test_invalid_operator(self):
+        "Ensure an unknown NeedProperty operator is reported"
+        self.assertRaises(ParserError, parse_string, u"NeedProperty: MEMORY => 2048",
+                raise_errors=True)
+
 class DestructiveFieldTests(unittest.TestCase):
     def test_destructive(self):
         ti = parse_string(u"Destructive: yes", raise_errors=False)
         self.assertEquals(ti.destructive, True)
 
+    def test_not_destructive(self):
+        ti = parse_string(u"Destructive: 0", raise_errors=False)
+        self.assertEquals(ti.destructive, False)
+
+    def test_destructive_bad_value(self):
+        self.assertRaises(ParserError, parse_string, u"Destructive: Yes", raise_errors=True)
+
 class SiteConfigDeclarationTests(unittest.TestCase):
     """Unit tests for the SiteConfig declaration"""
     
@@ -1076,6 +1265,28 @@ class SiteConfigDeclarationTests(unittest.TestCase):
         ti = parse_string(u"""SiteConfig(/stable-servers/ldap/hostname): Location of stable LDAP server to use""", raise_errors=False)
         self.assertEquals(ti.siteconfig, [(u'/stable-servers/ldap/hostname', u'Location of stable LDAP server to use')])
 
+    def test_siteconfig_with_colon(self):
+        "Ensure that a SiteConfig declaration whose argument contains a colon works"
+        ti = parse_string(u"SiteConfig(/servers/ldap:389): LDAP server and port",
+                raise_errors=False)
+        self.assertEquals(ti.siteconfig, [(u'/servers/ldap:389', u'LDAP server and port')])
+
+    def test_siteconfig_with_parentheses(self):
+        "Ensure a SiteConfig declaration with a second argument is rejected"
+        try:
+            parse_string(u"SiteConfig(foo)(bar): value", raise_errors=True)
+            self.fail("ParserError not raised")
+        except ParserError, e:
+            self.assertEquals(str(e), '"SiteConfig(foo)" is not a valid declaration')
+
+    def test_unknown_declaration(self):
+        "Ensure that a declaration other than SiteConfig is reported by name"
+        try:
+            parse_string(u"SiteConf(/servers/ldap): LDAP server", raise_errors=True)
+            self.fail("ParserError not raised")
+        except ParserError, e:
+            self.assertEquals(str(e), '"SiteConf" is not a valid declaration')
+
     #def test_siteconfig_comment(self):
     #    "Ensure that comments are stripped as expected from descriptions"
     #    ti = parse_string("SiteConfig(/foo/bar): Some value # hello world", raise_errors=False)
@@ -1173,6 +1384,22 @@ SiteConfig(/stable-servers/ldap/hostname): Location of stable LDAP server to use
                                            (u'/examples/coreutils/example-simple-test/tls/password', u'Password to use for TLS auth'),
                                            (u'/stable-servers/ldap/hostname', u'Location of stable LDAP server to use')])
 
+    def test_output_subclass_override(self):
+        "Ensure output() uses output_* methods overridden in a TestInfo subclass"
+        class UpperBoolTestInfo(TestInfo):
+            __slots__ = ()
+            def output_bool_field(self, lines, fileFieldName, dictFieldName):
+                if getattr(self, dictFieldName):
+                    lines.append(u'%s: YES\n'%fileFieldName)
+
+        ti = UpperBoolTestInfo()
+        ti.test_name = u'/foo/bar'
+        ti.destructive = True
+        file = tempfile.TemporaryFile()
+        ti.output(file)
+        file.seek(0)
+        self.assertEquals(file.read(), 'Name: /foo/bar\nDestructive: YES\n')
+
 #etc
 
 